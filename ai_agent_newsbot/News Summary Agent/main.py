@@ -1,52 +1,98 @@
 import re
-import math
 import json
 import os
+import asyncio
+import shutil
 import smtplib
+import tempfile
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 import backoff
 import requests
+import tiktoken
 import feedparser
 import concurrent.futures
 
-from io import BytesIO
 from datetime import datetime, timedelta
-from tqdm import tqdm
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pdfminer.high_level import extract_text
 
+import numpy as np
 import openai
 from llama_index.llms import OpenAI
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 
-def get_tech_news():
+# Shared HTTP session so connections are kept alive and reused across requests
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32,
+                                      max_retries=Retry(total=3, backoff_factor=0.5)))
+
+# Prompts used to summarize articles
+SUMMARY_PROMPT = "Concisely and simply explain what this text is about: "
+COMBINE_PROMPT = "Combine these partial summaries into one concise and simple explanation of what the text is about:\n\n"
+
+# Matches the news indexes in the selection responses
+NUMBER_PATTERN = re.compile(r'\b\d+\b')
+
+# Prompt and token budget for selecting the top news with a single request
+SELECTION_PROMPT = ("Give me the top 3, in your opinion, most interesting tech news, ranked. "
+                    "Respond only with JSON of the form {\"top\": [index1, index2, index3]} using the given indexes.")
+MAX_SELECTION_TOKENS = 6000
+
+# Token sizes of the article chunks and of the combined chunk summaries in the final summary call
+SUMMARY_CHUNK_TOKENS = 2000
+MAX_REDUCE_TOKENS = 6000
+_ENCODING = tiktoken.encoding_for_model("gpt-4")
+
+
+# RSS feeds to collect news from
+TECH_NEWS_FEEDS = (
+    'https://techcrunch.com/feed/',
+)
+
+
+def fetch_feed(feed_url):
+    """
+    Download and parse a single RSS feed.
+    """
+    try:
+        response = _SESSION.get(feed_url, timeout=30)
+        response.raise_for_status()
+        return feedparser.parse(response.content)
+    except requests.RequestException as e:
+        print(f"Error fetching feed: {feed_url}. Error: {e}")
+        return feedparser.parse(b"")
+
+
+def get_tech_news(feed_urls=TECH_NEWS_FEEDS):
     """
-    Retrieve tech news from TechCrunch's RSS feed.
+    Retrieve tech news from the given RSS feeds (TechCrunch by default).
+    Feeds are fetched concurrently.
     Returns a list of tuples containing (link, title, summary, content)
     """
-    # TechCrunch RSS feed URL
-    feed_url = 'https://techcrunch.com/feed/'
-    
     print("Fetching tech news...")
-    feed = feedparser.parse(feed_url)
+    if not feed_urls:
+        return []
+    # Feed fetching is IO-bound; keep the pool small to bound parser memory
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(4, len(feed_urls))) as executor:
+        feeds = list(executor.map(fetch_feed, feed_urls))
     news_list = []
 
-    # Get news from the last 24 hours
-    yesterday = datetime.now() - timedelta(days=1)
+    # Get news from the last 24 hours. Published dates are compared as
+    # (year, month, day, hour, minute, second) tuples to avoid building datetimes.
+    yesterday = (datetime.now() - timedelta(days=1)).timetuple()[:6]
     
-    for entry in feed.entries:
-        # Convert published date to datetime object
-        published_date = datetime(*entry.published_parsed[:6])
-        
-        if published_date >= yesterday:
-            try:
-                # Extract the main content from the article
-                content = entry.get('content', [{'value': ''}])[0]['value']
-                news_list.append((entry.link, entry.title, entry.summary, content))
-            except Exception as e:
-                print(f"Error processing news: {entry.title}. Error: {e}")
+    for feed in feeds:
+        for entry in feed.entries:
+            if tuple(entry.published_parsed[:6]) >= yesterday:
+                try:
+                    # Extract the main content from the article
+                    content = entry.get('content', [{'value': ''}])[0]['value']
+                    news_list.append((entry.link, entry.title, entry.summary, content))
+                except Exception as e:
+                    print(f"Error processing news: {entry.title}. Error: {e}")
 
     print(f"Found {len(news_list)} news articles.")
     return news_list
@@ -55,25 +101,26 @@ def get_tech_news():
 def extract_text_from_pdf(pdf_url):
     """
     Extracts and returns text content from a PDF located at the provided URL.
+    The PDF is streamed into a spooled temporary file instead of being buffered in memory.
     """
-    response = requests.get(pdf_url)
-    response.raise_for_status()
-    pdf_data = BytesIO(response.content)
-    
-    return extract_text(pdf_data)
+    with _SESSION.get(pdf_url, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with tempfile.SpooledTemporaryFile(max_size=2**19) as pdf_data:
+            shutil.copyfileobj(response.raw, pdf_data, length=65536)
+            pdf_data.seek(0)
+            return extract_text(pdf_data)
 
 
 @backoff.on_exception(backoff.expo,
-                      (openai.error.RateLimitError, concurrent.futures.TimeoutError),
+                      (openai.error.RateLimitError, asyncio.TimeoutError),
                       max_tries=4)
-def complete_with_retry(llm, text, timeout=120):
+async def complete_with_retry(llm, text, timeout=120):
     """
-    Send a request to llm.complete with retry, delay, and timeout.
+    Send a request to llm.acomplete with retry, delay, and timeout.
     """
     try:
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(llm.complete, text)
-            return future.result(timeout=timeout)
+        return await asyncio.wait_for(llm.acomplete(text), timeout=timeout)
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         raise
@@ -90,87 +137,117 @@ def concatenate_news(news_items, minimum_groups=4):
     leftover = total_items % minimum_groups
     
     current_group = 1
-    concatenated_string = ""
+    current_group_size = group_size + (1 if current_group <= leftover else 0)
+    parts = []
 
     for i, (link, title, summary, content) in enumerate(news_items, 1):
-        concatenated_string += f"{title}: {summary}; "
-        
-        current_group_size = group_size + (1 if current_group <= leftover else 0)
+        parts.append(f"{title}: {summary}; ")
         
         if i % current_group_size == 0:
-            grouped_strings.append(concatenated_string)
-            concatenated_string = ""
+            grouped_strings.append("".join(parts))
+            parts.clear()
             current_group += 1
+            current_group_size = group_size + (1 if current_group <= leftover else 0)
             
     return grouped_strings
 
 
-def generate_summary(text):
+async def summarize_chunks(llm, chunks, prompt):
+    """
+    Runs the prompt over every chunk concurrently and returns the results in order.
+    """
+    responses = await asyncio.gather(*[complete_with_retry(llm, prompt + chunk) for chunk in chunks])
+    return [response.text for response in responses]
+
+
+async def generate_summary(text, llm=None):
     """
     Generates a summary for the given text using GPT-4.
-    Uses a recursive approach to handle long texts.
+    Long texts are summarized chunk by chunk in parallel, then combined once.
     """
-    llm = OpenAI(temperature=0.7, model="gpt-4")
+    llm = llm or summary_llm
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2500,
-        chunk_overlap=0,
-        length_function=len,
-        is_separator_regex=False,
-    )
+    tokens = _ENCODING.encode(text)
+    docs = [_ENCODING.decode(tokens[i:i + SUMMARY_CHUNK_TOKENS])
+            for i in range(0, len(tokens), SUMMARY_CHUNK_TOKENS)]
+    if not docs:
+        return ""
 
-    docs = text_splitter.create_documents([text])
-    docs = [doc.page_content for doc in docs]
-    num_splits = int(math.log2(len(docs)))
+    # Map: summarize every chunk in a single parallel pass
+    summaries = await summarize_chunks(llm, docs, SUMMARY_PROMPT)
+    if len(summaries) == 1:
+        return summaries[0]
 
-    for _ in tqdm(range(num_splits)):
-        if len(docs) % 2 == 0:
-            docs = [docs[i] + docs[i + 1] for i in range(0, len(docs) - 1, 2)]
-        else:
-            last_doc = docs[-1]
-            docs = [docs[i] + docs[i + 1] for i in range(0, len(docs) - 1, 2)]
-            docs[-1] = docs[-1] + last_doc
-
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future_to_index = {executor.submit(
-            lambda i, doc: (i, complete_with_retry(llm, "Concisely and simply explain what this text is about: " + doc).text),
-            i, doc): i for i, doc in enumerate(docs)}
-    
-            for future in concurrent.futures.as_completed(future_to_index):
-                i, result = future.result()
-                docs[i] = result
+    # If the chunk summaries don't fit into one request, condense them once more
+    combined = "\n\n".join(summaries)
+    tokens = _ENCODING.encode(combined)
+    if len(tokens) > MAX_REDUCE_TOKENS:
+        parts = [_ENCODING.decode(tokens[i:i + MAX_REDUCE_TOKENS])
+                 for i in range(0, len(tokens), MAX_REDUCE_TOKENS)]
+        combined = "\n\n".join(await summarize_chunks(llm, parts, SUMMARY_PROMPT))
 
-    return docs[0]
+    # Reduce: combine the chunk summaries with a single call
+    response = await complete_with_retry(llm, COMBINE_PROMPT + combined)
+    return response.text
 
 
-def reduce_selection(llm, news_items):
+async def select_top_news(llm, news_items):
+    """
+    Selects the top 3 news items with a single request over the full news list.
+    Returns None if the list doesn't fit into one request or the response can't be parsed.
+    """
+    news_list = "".join(f"{i}. {title}: {summary}; " for i, (link, title, summary, content) in enumerate(news_items, 1))
+    if len(_ENCODING.encode(news_list)) > MAX_SELECTION_TOKENS:
+        return None
+
+    response = (await complete_with_retry(llm, news_list + SELECTION_PROMPT)).text
+    try:
+        indices = json.loads(response[response.index('{'):response.rindex('}') + 1])["top"]
+        if not isinstance(indices, list):
+            raise TypeError("'top' is not a list")
+    except (ValueError, KeyError, TypeError):
+        print("Could not parse the selection response.")
+        return None
+
+    valid_indices = [idx for idx in indices if isinstance(idx, int) and 1 <= idx <= len(news_items)]
+    return [news_items[idx - 1] for idx in dict.fromkeys(valid_indices)][:3]
+
+
+async def reduce_selection(llm, news_items):
     """
     Refines the selection of news items until there are 3 or fewer items.
-    Uses GPT-4 to select the most interesting news.
+    Uses GPT-4 to select the most interesting news, in a single request when the
+    news list fits, otherwise by repeatedly selecting from groups of news.
     """
     prompt = "Give me the top 3, in your opinion, most interesting tech news. Rank your choices. Do not change the given indexes."
     previous_news_items = []
 
     print("Selecting the top 3 news items.")
+    if len(news_items) > 3:
+        chosen_news = await select_top_news(llm, news_items)
+        if chosen_news:
+            remaining_items = [item for item in news_items if item not in chosen_news]
+            chosen_news.extend(remaining_items[:3 - len(chosen_news)])
+            print("Finished selecting the top 3 news items.")
+            return chosen_news
+
     while len(news_items) > 3:
         print(f"Current number of items: {len(news_items)}")
         previous_news_items = news_items.copy()
         contexts = concatenate_news(news_items)
-        all_chosen_indices = set()
+        chosen_mask = np.zeros(len(news_items), dtype=bool)
 
-        def process_context(context):
-            response = complete_with_retry(llm, context + prompt).text
+        async def process_context(context):
+            response = (await complete_with_retry(llm, context + prompt)).text
             max_index = len(news_items)
-            new_indices = [int(match) for match in re.findall(r'\b\d+\b', response) if int(match) <= max_index][1::2]
+            new_indices = [int(match) for match in NUMBER_PATTERN.findall(response) if 1 <= int(match) <= max_index][1::2]
             return new_indices
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(process_context, context) for context in contexts]
-            for future in concurrent.futures.as_completed(futures):
-                new_indices = future.result()
-                all_chosen_indices.update(new_indices)
+        for new_indices in await asyncio.gather(*[process_context(context) for context in contexts]):
+            chosen_mask[np.asarray(new_indices, dtype=np.int64) - 1] = True
 
-        news_items = [news_items[idx-1] for idx in all_chosen_indices]
+        # Keep the chosen items in their original order
+        news_items = [news_items[idx] for idx in np.flatnonzero(chosen_mask)]
 
     if len(news_items) < 3:
         remaining_items_needed = 3 - len(news_items)
@@ -184,17 +261,18 @@ def reduce_selection(llm, news_items):
     return news_items
 
 
-def create_news_strings(news_items):
+async def create_news_strings(news_items):
     """
     Generate formatted strings for a list of news items.
     """
     news_strings = []
 
-    for news in news_items:
-        link, title, summary, content = news
+    for link, title, summary, content in news_items:
         print(f"Now summarizing: {title}")
 
-        summary = generate_summary(content)
+    summaries = await asyncio.gather(*[generate_summary(content) for link, title, summary, content in news_items])
+
+    for (link, title, _, content), summary in zip(news_items, summaries):
         print(f"Summary complete: {summary}")
 
         news_string = f"Link: {link}\n\nTitle: {title}\n\nSummary: {summary}"
@@ -203,9 +281,37 @@ def create_news_strings(news_items):
     return news_strings
 
 
-def send_email(news_strings, config):
+class Mailer:
+    """
+    SMTP connection that stays open and logged in for sending several emails.
+    Use as a context manager.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.server = None
+
+    def __enter__(self):
+        self.server = smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port'])
+        self.server.starttls()
+        self.server.login(self.config['email_sender'], self.config['email_password'])
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.quit()
+        self.server = None
+
+    def send(self, msg):
+        """
+        Send a message over the open connection.
+        """
+        self.server.send_message(msg)
+
+
+def send_email(news_strings, config, mailer=None):
     """
     Send the news summaries via email.
+    Reuses the given Mailer's connection, or opens a new one.
     """
     # Create message
     msg = MIMEMultipart()
@@ -214,19 +320,20 @@ def send_email(news_strings, config):
     msg['Subject'] = f"Tech News Summary - {datetime.now().strftime('%Y-%m-%d')}"
 
     # Create email body
-    body = "Here are today's top tech news summaries:\n\n"
+    body_parts = ["Here are today's top tech news summaries:\n\n"]
     for i, news in enumerate(news_strings, 1):
-        body += f"--- News {i} ---\n{news}\n\n"
+        body_parts.append(f"--- News {i} ---\n{news}\n\n")
+    body = "".join(body_parts)
 
     msg.attach(MIMEText(body, 'plain'))
 
     # Send email
     try:
-        server = smtplib.SMTP(config['smtp_server'], config['smtp_port'])
-        server.starttls()
-        server.login(config['email_sender'], config['email_password'])
-        server.send_message(msg)
-        server.quit()
+        if mailer:
+            mailer.send(msg)
+        else:
+            with Mailer(config) as mailer:
+                mailer.send(msg)
         print("Email sent successfully!")
     except Exception as e:
         print(f"Failed to send email: {str(e)}")
@@ -240,9 +347,20 @@ with open(config_path, 'r') as file:
 # Initialize OpenAI
 openai.api_key = config['api_key']
 llm = OpenAI(temperature=0, model="gpt-4")
+summary_llm = OpenAI(temperature=0.7, model="gpt-4")
+
+
+async def main():
+    """
+    Fetch, select, summarize, and send the news.
+    """
+    news_items = get_tech_news()
+    chosen_news = await reduce_selection(llm, news_items)
+    news_strings = await create_news_strings(chosen_news)
+
+    # Send from a worker thread so the SMTP exchange doesn't block the event loop
+    await asyncio.get_running_loop().run_in_executor(None, send_email, news_strings, config)
+
 
 # Main execution
-news_items = get_tech_news()
-chosen_news = reduce_selection(llm, news_items)
-news_strings = create_news_strings(chosen_news)
-send_email(news_strings, config)
+asyncio.run(main())
@@ -0,0 +1,121 @@
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Hashable, List, Optional
+
+class QueryCache:
+    """Thread-safe LRU cache with time-to-live for exact-match lookups"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # key -> (timestamp, value), ordered from least to most recently used
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_exact(self, key: Hashable) -> Optional[Any]:
+        """Return the value stored under key, if present and not expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            timestamp, value = entry
+            if time.monotonic() - timestamp > self.ttl:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value, evicting the least recently used entry if full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all cached values."""
+        with self._lock:
+            self._entries.clear()
+
+class SemanticCache:
+    """In-memory cache that looks up values by embedding similarity"""
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1024, ttl: float = 3600.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # Normalized embeddings stacked row-wise, one row per cached value
+        self._matrix: Optional[np.ndarray] = None
+        self._timestamps = np.empty(0, dtype=np.float64)
+        self._values: List[Any] = []
+        self._tags: List[Hashable] = []
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, embedding, tag: Hashable = None) -> Optional[Any]:
+        """Return the most similar cached value above the threshold.
+
+        If a tag is given, only values stored with an equal tag can match.
+        Values older than the time-to-live never match.
+        """
+        with self._lock:
+            if self._matrix is None:
+                return None
+
+            similarities = self._matrix @ self._normalize(embedding)
+            similarities[time.monotonic() - self._timestamps > self.ttl] = -np.inf
+            if tag is not None:
+                similarities[[stored != tag for stored in self._tags]] = -np.inf
+
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                return self._values[best]
+
+            return None
+
+    def put(self, embedding, value: Any, tag: Hashable = None) -> None:
+        """Store a value under the given embedding."""
+        row = self._normalize(embedding)[np.newaxis, :]
+
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = row
+            else:
+                self._matrix = np.vstack([self._matrix, row])
+            self._timestamps = np.append(self._timestamps, time.monotonic())
+            self._values.append(value)
+            self._tags.append(tag)
+
+            # Evict oldest entries
+            if len(self._values) > self.max_entries:
+                overflow = len(self._values) - self.max_entries
+                self._matrix = self._matrix[overflow:]
+                self._timestamps = self._timestamps[overflow:]
+                self._values = self._values[overflow:]
+                self._tags = self._tags[overflow:]
+
+    def clear(self) -> None:
+        """Remove all cached values."""
+        with self._lock:
+            self._matrix = None
+            self._timestamps = np.empty(0, dtype=np.float64)
+            self._values = []
+            self._tags = []
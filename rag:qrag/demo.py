@@ -6,7 +6,10 @@ This script demonstrates the complete workflow of the QRAG system.
 """
 
 import os
+import logging
+from dotenv import load_dotenv
 from qrag_system import QRAGSystem
+from llm_generator import ContextSession
 
 def run_demo():
     """Run QRAG system demo."""
@@ -41,10 +44,10 @@ def run_demo():
         # Test query parsing only (works without API keys)
         parsed = qrag.query_parser.parse_query(query)
         print(f"Parsing result:")
-        print(f"  - Bloom's Level: {parsed.get('bloom_level', 'N/A')}")
-        print(f"  - Topic: {parsed.get('topic', 'N/A')}")
-        print(f"  - Quantity: {parsed.get('quantity', 'N/A')}")
-        print(f"  - Confidence: {parsed.get('confidence', 0):.2f}")
+        print(f"  - Bloom's Level: {parsed.bloom_level or 'N/A'}")
+        print(f"  - Topic: {parsed.topic or 'N/A'}")
+        print(f"  - Quantity: {parsed.quantity or 'N/A'}")
+        print(f"  - Confidence: {parsed.confidence:.2f}")
         
         retrieval_query = qrag.query_parser.generate_retrieval_query(parsed)
         print(f"Retrieval query: {retrieval_query}")
@@ -81,6 +84,9 @@ def interactive_demo():
     
     qrag = QRAGSystem()
     
+    # Follow-up queries often retrieve the same chunks; keep them in a stable order
+    session = ContextSession()
+    
     while True:
         print("\nEnter your query (type 'quit' to exit):")
         user_input = input("> ").strip()
@@ -104,7 +110,7 @@ def interactive_demo():
         # Run full process if API keys are available
         status = qrag.get_system_status()
         if status["openai_configured"] and status["pinecone_configured"]:
-            result = qrag.process_query(user_input)
+            result = qrag.process_query(user_input, session=session)
             
             if result["success"]:
                 print("\n✅ Question generation completed!")
@@ -119,6 +125,9 @@ def interactive_demo():
 if __name__ == "__main__":
     import sys
     
+    load_dotenv()
+    logging.basicConfig(level=os.getenv("QRAG_LOG_LEVEL", "INFO").upper(), format="%(message)s")
+    
     if len(sys.argv) > 1 and sys.argv[1] == "--interactive":
         interactive_demo()
     else:
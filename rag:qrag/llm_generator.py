@@ -1,13 +1,121 @@
 import os
-from openai import OpenAI
-from typing import List, Dict, Optional
+import re
+import json
+import asyncio
+import hashlib
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from typing import Hashable, List, Dict, Optional, Tuple
+
+from cache import QueryCache, SemanticCache
+from query_parser import ParsedQuery
+
+# Matches question numbering (1., 2., etc.) at the start of each line
+NUMBERING_PATTERN = re.compile(r'^\s*\d+\.\s+', re.MULTILINE)
+
+class LLMCache:
+    """Exact and semantic cache for LLM responses"""
+    
+    # Embedding input is truncated to stay well inside the model's token limit
+    max_embedding_chars = 20000
+    
+    def __init__(self, client: OpenAI, threshold: float = 0.92,
+                 embedding_model: str = "text-embedding-3-small"):
+        self.client = client
+        self.embedding_model = embedding_model
+        self._exact = QueryCache()
+        self._semantic = SemanticCache(threshold=threshold)
+    
+    @staticmethod
+    def make_key(system_prompt: str, user_prompt: str, parsed_query: ParsedQuery) -> str:
+        """Create exact-match key for a request."""
+        payload = json.dumps([system_prompt, user_prompt, parsed_query.to_dict()], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+    
+    @staticmethod
+    def make_tag(context: str, parsed_query: ParsedQuery) -> Hashable:
+        """Create the tag a semantic match must share: the request and its context."""
+        context_hash = hashlib.sha256(context.encode()).hexdigest()
+        return (parsed_query.bloom_level, parsed_query.topic, parsed_query.quantity,
+                parsed_query.question_type, context_hash)
+    
+    def embed(self, text: str) -> List[float]:
+        """Create embedding used for semantic lookup."""
+        response = self.client.embeddings.create(
+            model=self.embedding_model,
+            input=text[:self.max_embedding_chars]
+        )
+        return response.data[0].embedding
+    
+    def get(self, key: str, embedding: Optional[List[float]] = None,
+            tag: Hashable = None) -> Optional[Dict]:
+        """Look up a cached result by exact key, then by embedding.
+        
+        Semantic matches are limited to results stored with the same tag.
+        """
+        result = self._exact.get_exact(key)
+        if result is None and embedding is not None:
+            result = self._semantic.get(embedding, tag=tag)
+        return result
+    
+    def put(self, key: str, embedding: List[float], result: Dict, tag: Hashable = None) -> None:
+        """Store a result under both exact key and embedding."""
+        self._exact.put(key, result)
+        self._semantic.put(embedding, result, tag=tag)
+    
+    def clear(self) -> None:
+        """Remove all cached results."""
+        self._exact.clear()
+        self._semantic.clear()
+
+class ContextSession:
+    """Conversation-scoped ordering of the context chunks sent to the LLM"""
+    
+    def __init__(self):
+        # Order in which the session first saw each chunk, by chunk hash
+        self._positions: Dict[str, int] = {}
+    
+    def order_context(self, context: str) -> str:
+        """Return the context's chunks ordered by when the session first saw them.
+        
+        Only the given context is returned. Chunks shared with earlier requests
+        come first in a stable order, so consecutive requests share a prompt
+        prefix up to their first new chunk; new chunks follow in retrieval order.
+        """
+        chunks = {}
+        for chunk in context.split("\n\n"):
+            chunk = chunk.strip()
+            if chunk:
+                chunks.setdefault(hashlib.sha256(chunk.encode()).hexdigest(), chunk)
+        
+        for chunk_id in chunks:
+            self._positions.setdefault(chunk_id, len(self._positions))
+        
+        return "\n\n".join(chunks[chunk_id] for chunk_id in sorted(chunks, key=self._positions.get))
 
 class LLMGenerator:
     """Class for generating questions using OpenAI LLM"""
     
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key: Optional[str] = None, temperature: float = 0.7, use_cache: bool = True,
+                 client: Optional[OpenAI] = None, aclient: Optional[AsyncOpenAI] = None):
+        # Clients can be passed in so they (and their connection pools) are shared between generators
+        self.client = client or OpenAI(api_key=api_key)
+        self.api_key = api_key or self.client.api_key
+        
+        # Without an async client, mirror the sync client's configuration so both
+        # talk to the same endpoint with the same settings
+        self.aclient = aclient or AsyncOpenAI(
+            api_key=self.api_key,
+            organization=self.client.organization,
+            base_url=self.client.base_url,
+            timeout=self.client.timeout,
+            max_retries=self.client.max_retries,
+            default_headers=self.client._custom_headers
+        )
+        self.temperature = temperature
+        
+        # Response cache (only used for deterministic requests)
+        self.cache = LLMCache(self.client) if use_cache else None
         
         # Default system prompt
         self.default_system_prompt = """You are an expert educational content creator specializing in creating high-quality questions based on Bloom's Taxonomy. You create questions that promote critical thinking and deep understanding.
@@ -25,70 +133,148 @@ Guidelines for Bloom's Taxonomy levels:
 - Analyze: Break down information, compare and contrast
 - Evaluate: Make judgments, critique, assess
 - Create: Design, construct, develop new ideas"""
+        
+        # Static prompt prefixes per Bloom's level. Variable content is appended
+        # after these so repeated calls share the longest possible prompt prefix.
+        self.question_prompt_prefixes = {
+            level: self.create_prompt_prefix(level)
+            for level in ["Remember", "Understand", "Apply", "Analyze", "Evaluate", "Create"]
+        }
     
-    def create_question_prompt(self, context: str, parsed_query: Dict) -> str:
+    def create_aclient(self) -> AsyncOpenAI:
+        """Create a copy of the async client with its own connection pool.
+        
+        Async connections are bound to the event loop that opened them, so async
+        calls use a fresh pool and close it when they finish.
+        """
+        return self.aclient.with_options(
+            http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=100))
+        )
+    
+    def create_prompt_prefix(self, bloom_level: str) -> str:
+        """Create the static part of the question generation prompt."""
+        return f"""Requirements:
+1. Each item should clearly demonstrate {bloom_level} level thinking
+2. Items should be relevant to the context provided
+3. Items should be appropriate for educational use
+4. Format each item clearly and concisely
+5. Do not include explanations or additional text, just the requested items"""
+    
+    def create_question_prompt(self, context: str, parsed_query: ParsedQuery) -> str:
         """Create prompt for question generation."""
         
-        bloom_level = parsed_query.get("bloom_level", "Evaluate")
-        topic = parsed_query.get("topic", "general education")
-        quantity = parsed_query.get("quantity", 2)
-        question_type = parsed_query.get("question_type", "question")
+        bloom_level = parsed_query.bloom_level or "Evaluate"
+        topic = parsed_query.topic or "general education"
+        quantity = parsed_query.quantity or 2
+        question_type = parsed_query.question_type or "question"
         
-        prompt = f"""Context Information:
+        prefix = self.question_prompt_prefixes.get(bloom_level) or self.create_prompt_prefix(bloom_level)
+        
+        prompt = f"""{prefix}
+
+Context Information:
 {context}
 
 User Request:
 - Bloom's Taxonomy Level: {bloom_level}
 - Topic: {topic}
 - Number of {question_type}s: {quantity}
-- Original Query: {parsed_query.get('original_query', '')}
+- Original Query: {parsed_query.original_query}
 
 Please generate {quantity} {bloom_level}-level {question_type}s about {topic} based on the provided context.
 
-Requirements:
-1. Each {question_type} should clearly demonstrate {bloom_level} level thinking
-2. {question_type}s should be relevant to the context provided
-3. {question_type}s should be appropriate for educational use
-4. Format each {question_type} clearly and concisely
-5. Do not include explanations or additional text, just the {question_type}s
-
 Generate the {question_type}s now:"""
         
         return prompt
     
-    def generate_questions(self, context: str, parsed_query: Dict, 
-                          system_prompt: Optional[str] = None) -> Dict:
+    def is_cacheable(self, parsed_query: ParsedQuery) -> bool:
+        """Check whether a request's response can be served from cache.
+        
+        Sampled responses are only cached when the query is flagged as deterministic.
+        """
+        if not self.cache:
+            return False
+        return self.temperature == 0 or parsed_query.deterministic
+    
+    def create_messages(self, context: str, parsed_query: ParsedQuery,
+                        system_prompt: Optional[str] = None,
+                        session: Optional[ContextSession] = None) -> List[Dict]:
+        """Create chat messages for question generation.
+        
+        If a session is given, the context is sent in its own message right after
+        the system prompt, with chunks in the session's stable order, so requests
+        that share chunks also share a prompt prefix.
+        """
+        # Set system prompt
+        if not system_prompt:
+            system_prompt = self.default_system_prompt
+        messages = [
+            {
+                "role": "system",
+                "content": system_prompt
+            }
+        ]
+        
+        # Create prompt
+        if session is not None:
+            messages.append({
+                "role": "user",
+                "content": f"Context Information:\n{session.order_context(context)}"
+            })
+            context = "See the context information above."
+        messages.append({
+            "role": "user",
+            "content": self.create_question_prompt(context, parsed_query)
+        })
+        
+        return messages
+    
+    def check_cache(self, messages: List[Dict], context: str,
+                    parsed_query: ParsedQuery) -> Tuple[Optional[str], Optional[List[float]], Optional[Dict]]:
+        """Look up a request in the response cache.
+        
+        Returns the cache key (None if the request is not cacheable), the
+        request embedding (None on an exact hit) and the cached result.
+        """
+        if not self.is_cacheable(parsed_query):
+            return None, None, None
+        
+        system_prompt = messages[0]["content"]
+        user_prompt = messages[-1]["content"]
+        cache_key = self.cache.make_key(system_prompt, user_prompt, parsed_query)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cache_key, None, cached
+        
+        embedding = self.cache.embed(system_prompt + user_prompt)
+        tag = self.cache.make_tag(context, parsed_query)
+        return cache_key, embedding, self.cache.get(cache_key, embedding, tag)
+    
+    def generate_questions(self, context: str, parsed_query: ParsedQuery, 
+                          system_prompt: Optional[str] = None,
+                          session: Optional[ContextSession] = None) -> Dict:
         """Generate questions based on context and parsed query."""
         
         try:
-            # Create prompt
-            user_prompt = self.create_question_prompt(context, parsed_query)
+            messages = self.create_messages(context, parsed_query, system_prompt, session)
             
-            # Set system prompt
-            if not system_prompt:
-                system_prompt = self.default_system_prompt
+            # Check cache
+            cache_key, embedding, cached = self.check_cache(messages, context, parsed_query)
+            if cached is not None:
+                return {**cached, "parsed_query": parsed_query, "cached": True}
             
             # Call LLM
             completion = self.client.chat.completions.create(
                 model="gpt-4-turbo",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": user_prompt
-                    }
-                ],
-                temperature=0.7,
+                messages=messages,
+                temperature=self.temperature,
                 max_tokens=1000
             )
             
             # Extract result
             generated_content = completion.choices[0].message.content
             
-            return {
+            result = {
                 "success": True,
                 "questions": generated_content,
                 "model": "gpt-4-turbo",
@@ -96,6 +282,62 @@ Generate the {question_type}s now:"""
                 "parsed_query": parsed_query
             }
             
+            if cache_key:
+                self.cache.put(cache_key, embedding, result, self.cache.make_tag(context, parsed_query))
+            
+            return result
+            
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "parsed_query": parsed_query
+            }
+    
+    async def agenerate_questions(self, context: str, parsed_query: ParsedQuery,
+                                  system_prompt: Optional[str] = None,
+                                  session: Optional[ContextSession] = None,
+                                  aclient: Optional[AsyncOpenAI] = None) -> Dict:
+        """Generate questions based on context and parsed query using the async client.
+        
+        Without ``aclient``, a client is created for this call and closed afterwards.
+        """
+        if aclient is None:
+            async with self.create_aclient() as aclient:
+                return await self.agenerate_questions(context, parsed_query, system_prompt, session, aclient)
+        
+        try:
+            messages = self.create_messages(context, parsed_query, system_prompt, session)
+            
+            # Check cache (the embedding request is blocking, so run it in a thread)
+            loop = asyncio.get_running_loop()
+            cache_key, embedding, cached = await loop.run_in_executor(
+                None, self.check_cache, messages, context, parsed_query
+            )
+            if cached is not None:
+                return {**cached, "parsed_query": parsed_query, "cached": True}
+            
+            # Call LLM
+            completion = await aclient.chat.completions.create(
+                model="gpt-4-turbo",
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=1000
+            )
+            
+            result = {
+                "success": True,
+                "questions": completion.choices[0].message.content,
+                "model": "gpt-4-turbo",
+                "usage": completion.usage,
+                "parsed_query": parsed_query
+            }
+            
+            if cache_key:
+                self.cache.put(cache_key, embedding, result, self.cache.make_tag(context, parsed_query))
+            
+            return result
+            
         except Exception as e:
             return {
                 "success": False,
@@ -103,7 +345,41 @@ Generate the {question_type}s now:"""
                 "parsed_query": parsed_query
             }
     
-    def generate_questions_with_fallback(self, context: str, parsed_query: Dict) -> Dict:
+    async def agenerate_questions_batch(self, items: List[Tuple[str, ParsedQuery]],
+                                        aclient: Optional[AsyncOpenAI] = None) -> List[Dict]:
+        """Generate questions for several (context, parsed_query) pairs concurrently.
+        
+        Results are returned in the same order as ``items``. Without ``aclient``,
+        one client is created for the batch and closed afterwards.
+        """
+        if aclient is None:
+            async with self.create_aclient() as aclient:
+                return await self.agenerate_questions_batch(items, aclient)
+        
+        return await asyncio.gather(
+            *[self.agenerate_questions(context, parsed_query, aclient=aclient)
+              for context, parsed_query in items]
+        )
+    
+    def generate_questions_batch(self, items: List[Tuple[str, ParsedQuery]]) -> List[Dict]:
+        """Generate questions for several (context, parsed_query) pairs concurrently.
+        
+        Results are returned in the same order as ``items``. Inside a running
+        event loop, await ``agenerate_questions_batch`` instead.
+        """
+        if not items:
+            return []
+        
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.agenerate_questions_batch(items))
+        raise RuntimeError(
+            "generate_questions_batch() cannot be called from a running event loop; "
+            "await agenerate_questions_batch() instead"
+        )
+    
+    def generate_questions_with_fallback(self, context: str, parsed_query: ParsedQuery) -> Dict:
         """Generate questions using fallback model."""
         
         try:
@@ -146,20 +422,11 @@ Generate the {question_type}s now:"""
     
     def format_questions(self, questions_text: str) -> List[str]:
         """Format generated question text into individual question list."""
-        # Split by line breaks
-        lines = questions_text.strip().split('\n')
-        
-        # Remove empty lines and numbering
-        formatted_questions = []
-        for line in lines:
-            line = line.strip()
-            if line:
-                # Remove numbering (1., 2., etc.)
-                if line[0].isdigit() and '. ' in line:
-                    line = line.split('. ', 1)[1]
-                formatted_questions.append(line)
+        # Remove numbering (1., 2., etc.) from all lines at once
+        cleaned_text = NUMBERING_PATTERN.sub('', questions_text.strip())
         
-        return formatted_questions
+        # Split by line breaks and remove empty lines
+        return [line.strip() for line in cleaned_text.splitlines() if line.strip()]
     
     def validate_questions(self, questions: List[str], bloom_level: str) -> Dict:
         """Validate that generated questions meet requirements."""
@@ -201,14 +468,14 @@ def main():
     # Test data
     test_context = """Artificial Intelligence (AI) in education has become increasingly prevalent in recent years. AI technologies can personalize learning experiences, provide instant feedback, and help teachers identify areas where students need additional support. However, there are also concerns about privacy, data security, and the potential replacement of human teachers."""
     
-    test_parsed_query = {
-        "original_query": "Generate two Evaluate-level questions about AI in Education based on Bloom's Taxonomy.",
-        "bloom_level": "Evaluate",
-        "topic": "AI in Education",
-        "question_type": "question",
-        "quantity": 2,
-        "confidence": 0.9
-    }
+    test_parsed_query = ParsedQuery(
+        original_query="Generate two Evaluate-level questions about AI in Education based on Bloom's Taxonomy.",
+        bloom_level="Evaluate",
+        topic="AI in Education",
+        question_type="question",
+        quantity=2,
+        confidence=0.9
+    )
     
     # Test question generation
     print("Generating questions...")
@@ -1,8 +1,14 @@
-import PyPDF2
+import pypdfium2 as pdfium
 import re
-from typing import List, Dict
+import itertools
+import numpy as np
+from typing import List, Dict, Iterator
 import os
 
+WORD_PATTERN = re.compile(r'\S+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+SPECIAL_CHAR_PATTERN = re.compile(r'[^\w\s\.\,\!\?\;\:\-\(\)]')
+
 class PDFProcessor:
     """Class for processing PDF files to extract text and split into chunks"""
     
@@ -12,59 +18,99 @@ class PDFProcessor:
     def extract_text(self) -> str:
         """Extract text from PDF file."""
         try:
-            with open(self.pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+            pdf = pdfium.PdfDocument(self.pdf_path)
+            try:
+                pages = []
+                for page in pdf:
+                    textpage = page.get_textpage()
+                    pages.append(textpage.get_text_range())
+                    textpage.close()
+                    page.close()
+                return "\n".join(pages)
+            finally:
+                pdf.close()
         except Exception as e:
             print(f"Error extracting text from PDF: {e}")
             return ""
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize text."""
-        # Remove unnecessary whitespace
-        text = re.sub(r'\s+', ' ', text)
         # Clean special characters
-        text = re.sub(r'[^\w\s\.\,\!\?\;\:\-\(\)]', '', text)
+        text = SPECIAL_CHAR_PATTERN.sub('', text)
+        # Remove unnecessary whitespace, including gaps left by removed characters
+        text = WHITESPACE_PATTERN.sub(' ', text)
         return text.strip()
     
-    def split_into_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[Dict]:
-        """Split text into overlapping chunks."""
-        chunks = []
-        words = text.split()
+    def iter_split_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> Iterator[Dict]:
+        """Split text into overlapping chunks, yielding one chunk at a time."""
+        # Character span of every word, shape (num_words, 2)
+        word_spans = np.fromiter(
+            itertools.chain.from_iterable(match.span() for match in WORD_PATTERN.finditer(text)),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        num_words = len(word_spans)
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk_words = words[i:i + chunk_size]
-            chunk_text = " ".join(chunk_words)
-            
-            if chunk_text.strip():
-                chunks.append({
-                    "text": chunk_text,
-                    "chunk_id": len(chunks),
-                    "start_word": i,
-                    "end_word": min(i + chunk_size, len(words))
-                })
+        # Chunk boundaries in words, then in characters
+        start_words = np.arange(0, num_words, chunk_size - overlap, dtype=np.int64)
+        end_words = np.minimum(start_words + chunk_size, num_words)
+        start_chars = word_spans[start_words, 0]
+        end_chars = word_spans[end_words - 1, 1]
         
-        return chunks
+        # Slice each chunk directly out of the text instead of re-joining its words
+        for chunk_id, (start_word, end_word, start_char, end_char) in enumerate(zip(
+            start_words.tolist(), end_words.tolist(), start_chars.tolist(), end_chars.tolist()
+        )):
+            yield {
+                "text": text[start_char:end_char],
+                "chunk_id": chunk_id,
+                "start_word": start_word,
+                "end_word": end_word
+            }
     
-    def process_pdf(self, chunk_size: int = 1000, overlap: int = 200) -> List[Dict]:
-        """Process PDF and return list of chunks."""
+    def split_into_chunks(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[Dict]:
+        """Split text into overlapping chunks."""
+        return list(self.iter_split_chunks(text, chunk_size, overlap))
+    
+    def iter_chunks(self, chunk_size: int = 1000, overlap: int = 200) -> Iterator[Dict]:
+        """Process PDF and yield chunks one at a time."""
         print(f"Processing PDF file: {self.pdf_path}")
         
         # Extract text
         raw_text = self.extract_text()
         if not raw_text:
-            return []
+            return
         
         # Clean text
         cleaned_text = self.clean_text(raw_text)
         
         # Split into chunks
-        chunks = self.split_into_chunks(cleaned_text, chunk_size, overlap)
+        yield from self.iter_split_chunks(cleaned_text, chunk_size, overlap)
+    
+    def process_pdf(self, chunk_size: int = 1000, overlap: int = 200) -> List[Dict]:
+        """Process PDF and return list of chunks."""
+        chunks = list(self.iter_chunks(chunk_size, overlap))
+        
+        if chunks:
+            print(f"Generated {len(chunks)} chunks successfully")
+        return chunks
+    
+    def process_pdf_with_embeddings(self, embedding_client, batch_size: int = 256,
+                                    model: str = "text-embedding-3-small") -> List[Dict]:
+        """Process PDF and attach OpenAI embeddings to each chunk.
+        
+        Chunks are embedded in batches of ``batch_size`` inputs per request.
+        """
+        chunks = self.process_pdf()
+        
+        for i in range(0, len(chunks), batch_size):
+            batch = chunks[i:i + batch_size]
+            response = embedding_client.embeddings.create(
+                model=model,
+                input=[chunk["text"] for chunk in batch]
+            )
+            for chunk, item in zip(batch, response.data):
+                chunk["embedding"] = item.embedding
         
-        print(f"Generated {len(chunks)} chunks successfully")
         return chunks
 
 def main():
@@ -1,11 +1,28 @@
 import os
-from typing import Dict, List, Optional
+import io
+import copy
+import asyncio
+import logging
+import functools
+import tiktoken
+from typing import Dict, List, Optional, Tuple
 from dotenv import load_dotenv
+from openai import AsyncOpenAI
 
 from pdf_processor import PDFProcessor
 from query_parser import QueryParser
-from vector_store import VectorStore
-from llm_generator import LLMGenerator
+from llm_generator import LLMGenerator, ContextSession
+from cache import QueryCache, SemanticCache
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding() -> tiktoken.Encoding:
+    """Tokenizer of the model that generates questions, used to budget the context.
+    
+    Loaded on first use, since tiktoken may have to download it.
+    """
+    return tiktoken.encoding_for_model("gpt-4-turbo")
+
+logger = logging.getLogger("qrag")
 
 class QRAGSystem:
     """Main class for QRAG (Query-Augmented Retrieval Generation) system"""
@@ -25,84 +42,176 @@ class QRAGSystem:
         self.vector_store = None
         self.llm_generator = None
         
-        # Initialize vector store (if API key is available)
+        # Result caches for exact and semantically similar queries
+        self.query_cache = QueryCache()
+        self.semantic_cache = SemanticCache(threshold=0.92, ttl=self.query_cache.ttl)
+        self._cache_generation = 0
+        
+        # Initialize vector store (if API key is available); imported only when needed,
+        # since the embedding model and Pinecone client are slow to load
         if self.pinecone_api_key:
+            from vector_store import VectorStore
+            
             self.vector_store = VectorStore(
                 self.pinecone_api_key,
                 self.pinecone_environment,
-                self.pinecone_index_name
+                self.pinecone_index_name,
+                quantize=os.getenv("QRAG_EMBEDDING_QUANTIZATION", "").lower() == "int8",
+                transport=os.getenv("QRAG_PINECONE_TRANSPORT", "rest").lower()
             )
         
         # Initialize LLM generator (if API key is available)
         if self.openai_api_key:
             self.llm_generator = LLMGenerator(self.openai_api_key)
         
-        print("🚀 QRAG system initialized!")
+        logger.info("🚀 QRAG system initialized!")
     
     def setup_vector_database(self, pdf_path: str) -> bool:
         """Process PDF file and set up vector database."""
         if not self.vector_store:
-            print("❌ Pinecone API key not configured.")
+            logger.error("❌ Pinecone API key not configured.")
+            return False
+        
+        if not self.vector_store.index:
+            logger.error("❌ Vector database index not connected.")
             return False
         
         try:
-            # Process PDF
-            print("📄 Processing PDF file...")
+            # Stream chunks from the PDF straight into the vector database
+            logger.info("📄 Processing PDF file and uploading documents to vector database...")
             pdf_processor = PDFProcessor(pdf_path)
-            chunks = pdf_processor.process_pdf()
+            stored, failed = self.vector_store.upsert_stream(pdf_processor.iter_chunks())
             
-            if not chunks:
-                print("❌ Could not extract chunks from PDF.")
+            if not stored and not failed:
+                logger.error("❌ Could not extract chunks from PDF.")
                 return False
             
-            # Upsert to vector database
-            print("🗄️ Uploading documents to vector database...")
-            success = self.vector_store.upsert_documents(chunks)
-            
-            if success:
-                print(f"✅ Successfully stored {len(chunks)} documents in vector database.")
-                return True
-            else:
-                print("❌ Failed to upload to vector database.")
+            if failed:
+                logger.error("❌ Failed to upload %d of %d documents to vector database.", failed, stored + failed)
                 return False
+            
+            logger.info("✅ Successfully stored %d documents in vector database.", stored)
+            return True
                 
         except Exception as e:
-            print(f"❌ Error setting up vector database: {e}")
+            logger.error("❌ Error setting up vector database: %s", e)
             return False
     
-    def process_query(self, user_query: str, top_k: int = 5) -> Dict:
-        """Process user query to generate questions."""
+    def _get_cached(self, user_query: str, top_k: int) -> Optional[Dict]:
+        """Return a copy of the exact-match cached result for a query, if any."""
+        self._invalidate_stale_cache()
+        cached = self.query_cache.get_exact((user_query, top_k))
+        if cached is None:
+            return None
         
-        print(f"\n🔍 Starting query processing: {user_query}")
+        logger.info("⚡ Returning cached result.")
+        return {**copy.deepcopy(cached), "cached": True}
+    
+    def _start_query(self, user_query: str, top_k: int, query_embedding=None,
+                     embed: bool = True) -> Tuple[Optional[Dict], Dict]:
+        """Run the query steps before vector search.
+        
+        ``query_embedding`` is the embedding of ``user_query`` if already computed.
+        With ``embed=False`` the query is never embedded here, and the semantic
+        cache is skipped when no embedding was given.
+        Returns a finished result (cache hit or error) or None, and the query state.
+        """
+        logger.info("🔍 Starting query processing: %s", user_query)
+        state = {"cache_key": (user_query, top_k), "query_embedding": None}
+        
+        # Check exact-match cache
+        cached = self._get_cached(user_query, top_k)
+        if cached is not None:
+            return cached, state
         
         # Step 1: Query semantic parsing
-        print("📝 Step 1: Query semantic parsing...")
+        logger.info("📝 Step 1: Query semantic parsing...")
         parsed_query = self.query_parser.parse_query(user_query)
-        print(f"   Parsing result: {parsed_query}")
+        logger.debug("   Parsing result: %s", parsed_query)
+        state["parsed_query"] = parsed_query
+        
+        # Check semantic cache; only queries parsed to the same request can match
+        state["cache_tag"] = (
+            parsed_query.bloom_level, parsed_query.topic, parsed_query.quantity,
+            parsed_query.question_type, top_k
+        )
+        if self.vector_store and query_embedding is None and embed:
+            query_embeddings = self.vector_store.create_embeddings([user_query])
+            if len(query_embeddings):
+                query_embedding = query_embeddings[0]
+        if query_embedding is not None:
+            state["query_embedding"] = query_embedding
+            cached = self.semantic_cache.get(query_embedding, tag=state["cache_tag"])
+            if cached is not None:
+                logger.info("⚡ Returning cached result for similar query.")
+                return {**copy.deepcopy(cached), "original_query": user_query, "cached": True}, state
         
-        if parsed_query["confidence"] < 0.3:
-            print("⚠️ Query parsing confidence is low.")
+        if parsed_query.confidence < 0.3:
+            logger.warning("⚠️ Query parsing confidence is low.")
         
         # Step 2: Generate retrieval query
-        print("🔎 Step 2: Generate retrieval query...")
+        logger.info("🔎 Step 2: Generate retrieval query...")
         retrieval_query = self.query_parser.generate_retrieval_query(parsed_query)
-        print(f"   Retrieval query: {retrieval_query}")
+        logger.debug("   Retrieval query: %s", retrieval_query)
+        state["retrieval_query"] = retrieval_query
         
         # Step 3: Vector search
-        print("🔍 Step 3: Vector search...")
+        logger.info("🔍 Step 3: Vector search...")
         if not self.vector_store:
-            print("❌ Vector store not initialized.")
+            logger.error("❌ Vector store not initialized.")
             return {
                 "success": False,
                 "error": "Vector store not initialized",
                 "parsed_query": parsed_query
-            }
+            }, state
+        
+        return None, state
+    
+    def _build_context(self, docs: List[Dict], max_tokens: int = 3000) -> str:
+        """Join document texts into an LLM context of at most max_tokens tokens.
+        
+        Documents are added in ranking order until the budget is spent, and
+        near-duplicate chunks (same first 128 characters) are added only once.
+        """
+        encoding = _get_encoding()
+        context = io.StringIO()
+        seen = set()
+        remaining = max_tokens
+        
+        for doc in docs:
+            text = doc["text"].strip()
+            if not text:
+                continue
+            
+            fingerprint = hash(text[:128])
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            
+            tokens = encoding.encode(text)
+            if len(tokens) > remaining:
+                # Truncate only when nothing fits, so the context is never empty
+                if not context.tell():
+                    context.write(encoding.decode(tokens[:remaining]))
+                break
+            
+            if context.tell():
+                context.write("\n\n")
+            context.write(text)
+            remaining -= len(tokens)
+        
+        return context.getvalue()
+    
+    def _prepare_generation(self, state: Dict, search_results: List[Dict]) -> Optional[Dict]:
+        """Build the LLM context from search results.
         
-        search_results = self.vector_store.search(retrieval_query, top_k=top_k)
-        print(f"   Search results: {len(search_results)} documents")
+        Returns an error result if generation can't proceed, otherwise None.
+        """
+        parsed_query = state["parsed_query"]
+        logger.debug("   Search results: %d documents", len(search_results))
         
         if not search_results:
-            print("⚠️ No search results found.")
+            logger.warning("⚠️ No search results found.")
             return {
                 "success": False,
                 "error": "No search results found",
@@ -110,13 +219,15 @@ class QRAGSystem:
             }
         
         # Create context
-        context_text = "\n\n".join([doc["text"] for doc in search_results])
-        print(f"   Context length: {len(context_text)} characters")
+        context_text = self._build_context(search_results)
+        logger.debug("   Context length: %d characters", len(context_text))
+        state["search_results"] = search_results
+        state["context"] = context_text
         
         # Step 4: LLM question generation
-        print("🤖 Step 4: LLM question generation...")
+        logger.info("🤖 Step 4: LLM question generation...")
         if not self.llm_generator:
-            print("❌ LLM generator not initialized.")
+            logger.error("❌ LLM generator not initialized.")
             return {
                 "success": False,
                 "error": "LLM generator not initialized",
@@ -124,30 +235,43 @@ class QRAGSystem:
                 "context": context_text
             }
         
-        generation_result = self.llm_generator.generate_questions(context_text, parsed_query)
+        return None
+    
+    def _finish_query(self, user_query: str, state: Dict, generation_result: Dict) -> Dict:
+        """Build the final result from the generation result and cache it."""
+        parsed_query = state["parsed_query"]
+        context_text = state["context"]
         
         if generation_result["success"]:
-            print("✅ Question generation completed!")
+            logger.info("✅ Question generation completed!")
             
             # Process results
             formatted_questions = self.llm_generator.format_questions(
                 generation_result["questions"]
             )
             
-            return {
+            result = {
                 "success": True,
                 "original_query": user_query,
                 "parsed_query": parsed_query,
-                "retrieval_query": retrieval_query,
-                "search_results": search_results,
+                "retrieval_query": state["retrieval_query"],
+                "search_results": state["search_results"],
                 "context": context_text,
                 "generated_questions": generation_result["questions"],
                 "formatted_questions": formatted_questions,
                 "model": generation_result["model"],
                 "usage": generation_result.get("usage")
             }
+            
+            # Cache a copy, so callers can't modify cached results through the returned one
+            cached = copy.deepcopy(result)
+            self.query_cache.put(state["cache_key"], cached)
+            if state["query_embedding"] is not None:
+                self.semantic_cache.put(state["query_embedding"], cached, tag=state["cache_tag"])
+            
+            return result
         else:
-            print(f"❌ Question generation failed: {generation_result['error']}")
+            logger.error("❌ Question generation failed: %s", generation_result["error"])
             return {
                 "success": False,
                 "error": generation_result["error"],
@@ -155,6 +279,141 @@ class QRAGSystem:
                 "context": context_text
             }
     
+    def process_query(self, user_query: str, top_k: int = 5,
+                      session: Optional[ContextSession] = None) -> Dict:
+        """Process user query to generate questions.
+        
+        Pass the same ContextSession to consecutive queries so prompts sharing context chunks share a prefix.
+        """
+        result, state = self._start_query(user_query, top_k)
+        if result is not None:
+            return result
+        
+        search_results = self.vector_store.search(state["retrieval_query"], top_k=top_k)
+        error = self._prepare_generation(state, search_results)
+        if error is not None:
+            return error
+        
+        generation_result = self.llm_generator.generate_questions(
+            state["context"], state["parsed_query"], session=session
+        )
+        return self._finish_query(user_query, state, generation_result)
+    
+    async def aprocess_query(self, user_query: str, top_k: int = 5,
+                             session: Optional[ContextSession] = None,
+                             aclient: Optional[AsyncOpenAI] = None) -> Dict:
+        """Process user query to generate questions without blocking the event loop.
+        
+        Several queries can be processed concurrently with asyncio.gather; pass
+        them one ``aclient`` created in the same loop to share its connections.
+        """
+        cached = self._get_cached(user_query, top_k)
+        if cached is not None:
+            return cached
+        
+        # Embed the query for the semantic cache in a worker thread
+        query_embedding = None
+        if self.vector_store:
+            loop = asyncio.get_running_loop()
+            query_embeddings = await loop.run_in_executor(
+                None, self.vector_store.create_embeddings, [user_query]
+            )
+            if len(query_embeddings):
+                query_embedding = query_embeddings[0]
+        
+        result, state = self._start_query(user_query, top_k, query_embedding, embed=False)
+        if result is not None:
+            return result
+        
+        search_results = await self.vector_store.asearch(state["retrieval_query"], top_k=top_k)
+        error = self._prepare_generation(state, search_results)
+        if error is not None:
+            return error
+        
+        generation_result = await self.llm_generator.agenerate_questions(
+            state["context"], state["parsed_query"], session=session, aclient=aclient
+        )
+        return self._finish_query(user_query, state, generation_result)
+    
+    def process_queries(self, user_queries: List[str], top_k: int = 5) -> List[Dict]:
+        """Process several user queries at once.
+        
+        Repeated queries are processed once, cached queries are answered before
+        any embedding, and the rest are embedded and searched in batches with
+        questions generated concurrently. Results are returned in query order.
+        Inside a running event loop, gather ``aprocess_query`` calls instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(
+                "process_queries() cannot be called from a running event loop; "
+                "use asyncio.gather() over aprocess_query() instead"
+            )
+        
+        # Each distinct query is processed once; exact cache hits are resolved first
+        queries = list(dict.fromkeys(user_queries))
+        results: List[Optional[Dict]] = [self._get_cached(user_query, top_k) for user_query in queries]
+        misses = [i for i, result in enumerate(results) if result is None]
+        
+        # Embed the remaining queries for the semantic cache at once
+        query_embeddings = {}
+        if self.vector_store and misses:
+            embeddings = self.vector_store.create_embeddings([queries[i] for i in misses])
+            if len(embeddings):
+                query_embeddings = dict(zip(misses, embeddings))
+        
+        # Parse queries and collect those that still need retrieval
+        states = {}
+        for i in misses:
+            result, state = self._start_query(queries[i], top_k, query_embeddings.get(i), embed=False)
+            if result is not None:
+                results[i] = result
+            else:
+                states[i] = state
+        
+        # Search for all remaining queries in one batch
+        pending = list(states)
+        if pending:
+            retrieval_queries = [states[i]["retrieval_query"] for i in pending]
+            for i, search_results in zip(pending, self.vector_store.search_batch(retrieval_queries, top_k=top_k)):
+                error = self._prepare_generation(states[i], search_results)
+                if error is not None:
+                    results[i] = error
+        
+        # Generate questions for all remaining queries concurrently
+        pending = [i for i in pending if results[i] is None]
+        if pending:
+            generation_results = self.llm_generator.generate_questions_batch(
+                [(states[i]["context"], states[i]["parsed_query"]) for i in pending]
+            )
+            for i, generation_result in zip(pending, generation_results):
+                results[i] = self._finish_query(queries[i], states[i], generation_result)
+        
+        # Repeated queries get their own copy of the shared result
+        by_query = dict(zip(queries, results))
+        seen = set()
+        ordered = []
+        for user_query in user_queries:
+            result = by_query[user_query]
+            ordered.append(copy.deepcopy(result) if user_query in seen else result)
+            seen.add(user_query)
+        return ordered
+    
+    def _invalidate_stale_cache(self):
+        """Clear cached results if the vector database changed since they were stored."""
+        generation = self.vector_store.generation if self.vector_store else 0
+        if generation != self._cache_generation:
+            self.clear_cache()
+            self._cache_generation = generation
+    
+    def clear_cache(self):
+        """Clear all cached query results."""
+        self.query_cache.clear()
+        self.semantic_cache.clear()
+    
     def get_system_status(self) -> Dict:
         """Check system status."""
         status = {
@@ -175,37 +434,37 @@ class QRAGSystem:
     
     def test_system(self) -> Dict:
         """Test the entire system."""
-        print("🧪 Starting QRAG system test...")
+        logger.info("🧪 Starting QRAG system test...")
         
         # Check system status
         status = self.get_system_status()
-        print(f"System status: {status}")
+        logger.info("System status: %s", status)
         
         # Test query
         test_query = "Generate two Evaluate-level questions about AI in Education based on Bloom's Taxonomy."
         
         # Test query parsing
-        print("\n📝 Testing query parsing...")
+        logger.info("📝 Testing query parsing...")
         parsed = self.query_parser.parse_query(test_query)
-        print(f"Parsing result: {parsed}")
+        logger.info("Parsing result: %s", parsed)
         
         # Test retrieval query generation
-        print("\n🔎 Testing retrieval query generation...")
+        logger.info("🔎 Testing retrieval query generation...")
         retrieval_query = self.query_parser.generate_retrieval_query(parsed)
-        print(f"Retrieval query: {retrieval_query}")
+        logger.info("Retrieval query: %s", retrieval_query)
         
         # Test vector search (if vector store is available)
         if self.vector_store:
-            print("\n🔍 Testing vector search...")
+            logger.info("🔍 Testing vector search...")
             search_results = self.vector_store.search(retrieval_query, top_k=3)
-            print(f"Search results: {len(search_results)} found")
+            logger.info("Search results: %d found", len(search_results))
         
         # Test LLM generation (if LLM is available)
         if self.llm_generator:
-            print("\n🤖 Testing LLM generation...")
+            logger.info("🤖 Testing LLM generation...")
             test_context = "AI in education can help personalize learning experiences for students."
             result = self.llm_generator.generate_questions(test_context, parsed)
-            print(f"Generation result: {'Success' if result['success'] else 'Failed'}")
+            logger.info("Generation result: %s", "Success" if result["success"] else "Failed")
         
         return {
             "status": status,
@@ -216,6 +475,8 @@ class QRAGSystem:
 
 def main():
     """Main function - Test QRAG system"""
+    load_dotenv()
+    logging.basicConfig(level=os.getenv("QRAG_LOG_LEVEL", "INFO").upper(), format="%(message)s")
     
     # Initialize QRAG system
     qrag = QRAGSystem()
@@ -1,6 +1,23 @@
 import re
+import ahocorasick
+from dataclasses import dataclass, asdict
 from typing import Dict, Optional, List
 
+@dataclass(slots=True)
+class ParsedQuery:
+    """Information extracted from a user query"""
+    original_query: str
+    bloom_level: Optional[str] = None
+    topic: Optional[str] = None
+    question_type: Optional[str] = None
+    quantity: Optional[int] = None
+    confidence: float = 0.0
+    # Allows caching sampled LLM responses for this query
+    deterministic: bool = False
+    
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
 class QueryParser:
     """Class for semantically parsing user queries"""
     
@@ -22,119 +39,174 @@ class QueryParser:
             "science education", "language learning", "assessment",
             "personalized learning", "digital literacy", "problem solving"
         ]
-    
-    def extract_bloom_level(self, query: str) -> Optional[str]:
-        """Extract Bloom's Taxonomy level from query."""
-        query_lower = query.lower()
         
-        # Direct level matching
-        for level, keywords in self.bloom_levels.items():
-            if level in query_lower:
+        # Question types
+        self.question_types = ["question", "problem", "task", "exercise"]
+        
+        # Text numbers
+        self.text_numbers = {
+            "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+            "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10
+        }
+        
+        # Precompiled patterns
+        self.about_pattern = re.compile(r"about\s+([^,\.]+)")
+        self.number_pattern = re.compile(r"(\d+)\s+(question|problem|task|exercise)")
+        
+        # Reverse lookup from each Bloom keyword (including the level name) to its level
+        self._bloom_lookup = {
+            keyword: level
+            for level, level_keywords in self.bloom_levels.items()
+            for keyword in [level, *level_keywords]
+        }
+        
+        # Aho-Corasick automaton finding all keywords of every category in one pass.
+        # Each keyword maps to the (category, value) pairs it signals.
+        keywords = {}
+        for keyword, level in self._bloom_lookup.items():
+            keywords.setdefault(keyword, []).append(("bloom_level", level))
+        for topic in self.education_topics:
+            keywords.setdefault(topic, []).append(("topic", topic))
+        for question_type in self.question_types:
+            keywords.setdefault(question_type, []).append(("question_type", question_type))
+        for text in self.text_numbers:
+            keywords.setdefault(text, []).append(("quantity", text))
+        
+        self.keyword_automaton = ahocorasick.Automaton()
+        for keyword, entries in keywords.items():
+            self.keyword_automaton.add_word(keyword, entries)
+        self.keyword_automaton.make_automaton()
+    
+    def scan_keywords(self, query_lower: str) -> Dict[str, set]:
+        """Find all known keywords in a lowercased query, grouped by category."""
+        hits = {"bloom_level": set(), "topic": set(), "question_type": set(), "quantity": set()}
+        for _, entries in self.keyword_automaton.iter(query_lower):
+            for category, value in entries:
+                hits[category].add(value)
+        return hits
+    
+    def _extract_bloom_level(self, query_lower: str, hits: Dict[str, set]) -> Optional[str]:
+        # Levels are checked in taxonomy order
+        for level in self.bloom_levels:
+            if level in hits["bloom_level"]:
                 return level.title()
-            
-            # Keyword matching
-            for keyword in keywords:
-                if keyword in query_lower:
-                    return level.title()
         
         return None
     
-    def extract_topic(self, query: str) -> Optional[str]:
-        """Extract topic from query."""
-        query_lower = query.lower()
-        
+    def _extract_topic(self, query_lower: str, hits: Dict[str, set]) -> Optional[str]:
         # "about" pattern matching
-        about_pattern = r"about\s+([^,\.]+)"
-        about_match = re.search(about_pattern, query_lower)
+        about_match = self.about_pattern.search(query_lower)
         if about_match:
             topic = about_match.group(1).strip()
             return topic.title()
         
         # Education topic matching
         for topic in self.education_topics:
-            if topic in query_lower:
+            if topic in hits["topic"]:
                 return topic.title()
         
         return None
     
-    def extract_question_type(self, query: str) -> Optional[str]:
-        """Extract question type from query."""
-        query_lower = query.lower()
-        
-        if "question" in query_lower:
-            return "question"
-        elif "problem" in query_lower:
-            return "problem"
-        elif "task" in query_lower:
-            return "task"
-        elif "exercise" in query_lower:
-            return "exercise"
+    def _extract_question_type(self, query_lower: str, hits: Dict[str, set]) -> Optional[str]:
+        for question_type in self.question_types:
+            if question_type in hits["question_type"]:
+                return question_type
         
         return None
     
-    def extract_quantity(self, query: str) -> Optional[int]:
-        """Extract requested quantity from query."""
+    def _extract_quantity(self, query_lower: str, hits: Dict[str, set]) -> Optional[int]:
         # Number pattern matching
-        number_pattern = r"(\d+)\s+(question|problem|task|exercise)"
-        match = re.search(number_pattern, query.lower())
+        match = self.number_pattern.search(query_lower)
         if match:
             return int(match.group(1))
         
         # Text number matching
-        text_numbers = {
-            "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
-            "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10
-        }
-        
-        for text, num in text_numbers.items():
-            if text in query.lower():
+        for text, num in self.text_numbers.items():
+            if text in hits["quantity"]:
                 return num
         
         return None
     
-    def parse_query(self, query: str) -> Dict:
+    def extract_bloom_level(self, query: str, hits: Optional[Dict[str, set]] = None) -> Optional[str]:
+        """Extract Bloom's Taxonomy level from query."""
+        query_lower = query.lower()
+        if hits is None:
+            hits = self.scan_keywords(query_lower)
+        return self._extract_bloom_level(query_lower, hits)
+    
+    def extract_topic(self, query: str, hits: Optional[Dict[str, set]] = None) -> Optional[str]:
+        """Extract topic from query."""
+        query_lower = query.lower()
+        if hits is None:
+            hits = self.scan_keywords(query_lower)
+        return self._extract_topic(query_lower, hits)
+    
+    def extract_question_type(self, query: str, hits: Optional[Dict[str, set]] = None) -> Optional[str]:
+        """Extract question type from query."""
+        query_lower = query.lower()
+        if hits is None:
+            hits = self.scan_keywords(query_lower)
+        return self._extract_question_type(query_lower, hits)
+    
+    def extract_quantity(self, query: str, hits: Optional[Dict[str, set]] = None) -> Optional[int]:
+        """Extract requested quantity from query."""
+        query_lower = query.lower()
+        if hits is None:
+            hits = self.scan_keywords(query_lower)
+        return self._extract_quantity(query_lower, hits)
+    
+    def parse_query(self, query: str) -> ParsedQuery:
         """Parse query completely."""
-        parsed = {
-            "original_query": query,
-            "bloom_level": self.extract_bloom_level(query),
-            "topic": self.extract_topic(query),
-            "question_type": self.extract_question_type(query),
-            "quantity": self.extract_quantity(query),
-            "confidence": 0.0
-        }
+        # Lowercase once and find keywords of all categories in a single pass
+        query_lower = query.lower()
+        hits = self.scan_keywords(query_lower)
+        
+        parsed = ParsedQuery(
+            original_query=query,
+            bloom_level=self._extract_bloom_level(query_lower, hits),
+            topic=self._extract_topic(query_lower, hits),
+            question_type=self._extract_question_type(query_lower, hits),
+            quantity=self._extract_quantity(query_lower, hits)
+        )
         
         # Calculate confidence score based on extracted information
         confidence_score = 0
-        if parsed["bloom_level"]:
+        if parsed.bloom_level:
             confidence_score += 0.3
-        if parsed["topic"]:
+        if parsed.topic:
             confidence_score += 0.3
-        if parsed["question_type"]:
+        if parsed.question_type:
             confidence_score += 0.2
-        if parsed["quantity"]:
+        if parsed.quantity:
             confidence_score += 0.2
         
-        parsed["confidence"] = confidence_score
+        parsed.confidence = confidence_score
         
         return parsed
     
-    def generate_retrieval_query(self, parsed: Dict) -> str:
+    def generate_retrieval_query(self, parsed: ParsedQuery) -> str:
         """Generate retrieval query based on parsed information."""
-        parts = []
+        topic = parsed.topic
+        bloom_level = parsed.bloom_level
+        question_type = parsed.question_type
         
-        if parsed["topic"]:
-            parts.append(parsed["topic"])
+        # A confidently parsed topic is the most precise query to embed
+        if parsed.confidence >= 0.6 and topic:
+            return f"{topic} {bloom_level} level assessment" if bloom_level else topic
+        
+        parts = []
         
-        if parsed["bloom_level"]:
-            parts.append(f"Bloom's Taxonomy {parsed['bloom_level']} level")
+        if topic:
+            parts.append(topic)
         
-        if parsed["question_type"]:
-            parts.append(f"{parsed['question_type']} examples")
+        if bloom_level:
+            parts.append(f"Bloom's Taxonomy {bloom_level} level")
         
-        # Add default keywords
-        parts.extend(["education", "learning", "assessment"])
+        if question_type:
+            parts.append(f"{question_type} examples")
         
-        return " AND ".join(parts)
+        # Nothing was recognized, so search with the query itself
+        return " AND ".join(parts) or parsed.original_query
 
 def main():
     """Main function for testing"""
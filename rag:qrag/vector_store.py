@@ -1,44 +1,158 @@
 import os
-import pinecone
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Optional
+import time
+import logging
+import queue
+import functools
+import asyncio
+from typing import List, Dict, Iterable, NamedTuple, Optional, Tuple
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("qrag")
+
+class VectorRecord(NamedTuple):
+    """Index record in the (id, values, metadata) tuple form both Pinecone transports accept"""
+    id: str
+    values: List[float]
+    metadata: Dict
+
+@functools.lru_cache(maxsize=2)
+def _get_embed_model(name: str, device: str):
+    """Load an embedding model once per process and share it across VectorStores."""
+    from sentence_transformers import SentenceTransformer
+    
+    model = SentenceTransformer(name, device=device)
+    if device == "cuda":
+        model.half()
+    model.eval()
+    return model
 
 class VectorStore:
     """Class for interacting with vector database"""
     
-    def __init__(self, api_key: str, environment: str, index_name: str):
+    def __init__(self, api_key: str, environment: str, index_name: str, quantize: bool = False,
+                 transport: str = "rest"):
         self.api_key = api_key
         self.environment = environment
         self.index_name = index_name
         
+        # Store and query int8-quantized embeddings (intended for cosine-metric indexes)
+        self.quantize = quantize
+        
+        # Incremented whenever the index contents change, so callers can invalidate caches
+        self.generation = 0
+        
+        # (timestamp, stats) of the last describe_index_stats call
+        self._stats_cache = (0.0, None)
+        self.stats_ttl = 5.0
+        
+        # Heavy dependencies are imported here so that importing this module stays cheap
+        import torch
+        import pinecone
+        
         # Initialize Pinecone
         pinecone.init(api_key=api_key, environment=environment)
         
-        # Initialize embedding model
-        self.embed_model = SentenceTransformer("all-MiniLM-L6-v2")
+        # Initialize embedding model (half precision on GPU, shared between instances)
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.embed_model = _get_embed_model("all-MiniLM-L6-v2", self.device)
         
-        # Connect to index
+        # Connect to index; the gRPC client needs the pinecone-client[grpc] extra
         try:
-            self.index = pinecone.Index(index_name)
-            print(f"Connected to Pinecone index '{index_name}'.")
+            if transport == "grpc":
+                self.index = pinecone.GRPCIndex(index_name)
+            else:
+                self.index = pinecone.Index(index_name, pool_threads=30)
+            logger.info("Connected to Pinecone index '%s' over %s.", index_name, transport)
         except Exception as e:
-            print(f"Failed to connect to Pinecone index: {e}")
+            logger.error("Failed to connect to Pinecone index: %s", e)
             self.index = None
+        
+        # Open the connection now and fill the stats cache, so the first request doesn't pay for it
+        if self.index:
+            try:
+                self._stats_cache = (time.monotonic(), self.index.describe_index_stats())
+            except Exception as e:
+                logger.warning("Failed to warm up Pinecone connection: %s", e)
     
-    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Convert list of texts to embeddings."""
+    def create_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Convert list of texts to normalized embeddings.
+        
+        Returns a contiguous float32 array with one row per text.
+        """
+        import torch
+        
         try:
-            embeddings = self.embed_model.encode(texts)
-            return embeddings.tolist()
+            # Skip autograd bookkeeping during inference
+            with torch.inference_mode():
+                embeddings = self.embed_model.encode(
+                    texts,
+                    batch_size=64,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True,
+                    show_progress_bar=False
+                )
+            # The half-precision GPU model returns float16
+            return np.ascontiguousarray(embeddings, dtype=np.float32)
         except Exception as e:
-            print(f"Error creating embeddings: {e}")
-            return []
+            logger.error("Error creating embeddings: %s", e)
+            return np.empty((0, 0), dtype=np.float32)
+    
+    @staticmethod
+    def quantize_embeddings(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Scalar-quantize embeddings to int8 with one scale per row.
+        
+        Returns the int8 values and the scales, where values = round(embeddings * scales).
+        """
+        max_abs = np.max(np.abs(embeddings), axis=1, keepdims=True)
+        scales = 127.0 / np.where(max_abs > 0, max_abs, 1.0)
+        return np.round(embeddings * scales).astype(np.int8), scales[:, 0]
+    
+    def to_index_values(self, embeddings: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Convert embeddings to the values sent to the index, and their quantization scales."""
+        if not self.quantize:
+            return embeddings, None
+        
+        # Integer-valued vectors have the same cosine similarities as the dequantized
+        # ones (values / scales) but serialize to far fewer bytes
+        quantized, scales = self.quantize_embeddings(embeddings)
+        return quantized.astype(np.float32), scales
+    
+    @staticmethod
+    def wait_for_upsert(async_result, timeout: float = 60):
+        """Wait for an upsert submitted with async_req=True and return its response."""
+        # The gRPC client returns futures, the REST client returns pool results
+        if hasattr(async_result, "result"):
+            return async_result.result(timeout=timeout)
+        return async_result.get(timeout=timeout)
+    
+    def build_vectors(self, documents: List[Dict], embeddings: np.ndarray, offset: int = 0) -> List[VectorRecord]:
+        """Build index records for documents and their embeddings.
+        
+        ``offset`` is the position of the first document in the whole upload, used
+        for documents without a ``chunk_id``.
+        """
+        values, scales = self.to_index_values(embeddings)
+        
+        vectors = []
+        for i, (doc, embedding) in enumerate(zip(documents, values.tolist()), offset):
+            metadata = {
+                "text": doc["text"],
+                "chunk_id": doc.get("chunk_id", i),
+                "source": doc.get("source", "pdf"),
+                "topic": doc.get("topic", ""),
+                "bloom_level": doc.get("bloom_level", "")
+            }
+            if scales is not None:
+                metadata["quantization_scale"] = float(scales[i - offset])
+            vectors.append(VectorRecord(f"doc_{doc.get('chunk_id', i)}", embedding, metadata))
+        
+        return vectors
     
     def upsert_documents(self, documents: List[Dict]) -> bool:
         """Upsert documents to vector database."""
         if not self.index:
-            print("Index not connected.")
+            logger.error("Index not connected.")
             return False
         
         try:
@@ -46,80 +160,207 @@ class VectorStore:
             texts = [doc["text"] for doc in documents]
             embeddings = self.create_embeddings(texts)
             
-            if not embeddings:
+            if not len(embeddings):
                 return False
             
-            # Prepare data for Pinecone upsert
-            vectors = []
-            for i, (doc, embedding) in enumerate(zip(documents, embeddings)):
-                vector_data = {
-                    "id": f"doc_{doc.get('chunk_id', i)}",
-                    "values": embedding,
-                    "metadata": {
-                        "text": doc["text"],
-                        "chunk_id": doc.get("chunk_id", i),
-                        "source": doc.get("source", "pdf"),
-                        "topic": doc.get("topic", ""),
-                        "bloom_level": doc.get("bloom_level", "")
-                    }
-                }
-                vectors.append(vector_data)
+            # Upsert batches in parallel, converting embeddings to lists one batch at a time
+            batch_size = 200
+            async_results = []
+            for start in range(0, len(documents), batch_size):
+                vectors = self.build_vectors(
+                    documents[start:start + batch_size], embeddings[start:start + batch_size], start
+                )
+                async_results.append(self.index.upsert(vectors=vectors, async_req=True))
             
-            # Upsert in batches
-            batch_size = 100
-            for i in range(0, len(vectors), batch_size):
-                batch = vectors[i:i + batch_size]
-                self.index.upsert(vectors=batch)
+            # Wait for all batches and report every failed one
+            failed_batches = 0
+            for batch_number, async_result in enumerate(async_results):
+                try:
+                    self.wait_for_upsert(async_result)
+                except Exception as e:
+                    failed_batches += 1
+                    logger.error("Error upserting batch %d: %s", batch_number, e)
+            self.generation += 1
+            self._stats_cache = (0.0, None)
+            
+            if failed_batches:
+                logger.error("Failed to store %d of %d batches.", failed_batches, len(async_results))
+                return False
             
-            print(f"Successfully stored {len(vectors)} documents in vector database.")
+            logger.info("Successfully stored %d documents in vector database.", len(documents))
             return True
             
         except Exception as e:
-            print(f"Error upserting documents: {e}")
+            logger.error("Error upserting documents: %s", e)
             return False
     
+    def upsert_stream(self, documents: Iterable[Dict], batch_size: int = 200) -> Tuple[int, int]:
+        """Upsert documents from an iterable without materializing them all.
+        
+        Documents are read in batches on the calling thread while a worker thread
+        embeds the previous batch and submits it to the index, so chunking,
+        embedding and uploading overlap. Returns the number of documents stored
+        and the number of documents in failed batches.
+        """
+        if not self.index:
+            logger.error("Index not connected.")
+            return 0, 0
+        
+        # Bounded so a fast producer cannot buffer the whole document in memory
+        batches = queue.Queue(maxsize=4)
+        
+        def embed_and_submit():
+            async_results, batch_sizes = [], []
+            while True:
+                item = batches.get()
+                if item is None:
+                    return async_results, batch_sizes
+                
+                offset, batch_documents = item
+                batch_sizes.append(len(batch_documents))
+                
+                # Record failures instead of raising, so the producer never blocks on a full queue
+                try:
+                    embeddings = self.create_embeddings([doc["text"] for doc in batch_documents])
+                    if not len(embeddings):
+                        raise RuntimeError("could not create embeddings")
+                    vectors = self.build_vectors(batch_documents, embeddings, offset)
+                    async_results.append(self.index.upsert(vectors=vectors, async_req=True))
+                except Exception as e:
+                    async_results.append(e)
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            worker = executor.submit(embed_and_submit)
+            
+            offset, batch = 0, []
+            try:
+                for doc in documents:
+                    batch.append(doc)
+                    if len(batch) == batch_size:
+                        batches.put((offset, batch))
+                        offset, batch = offset + len(batch), []
+                if batch:
+                    batches.put((offset, batch))
+            finally:
+                # Always stop the worker, even if reading documents failed
+                batches.put(None)
+            
+            async_results, batch_sizes = worker.result()
+        
+        # Wait for all batches and count documents in failed ones
+        failed = 0
+        for batch_number, (async_result, size) in enumerate(zip(async_results, batch_sizes)):
+            try:
+                if isinstance(async_result, Exception):
+                    raise async_result
+                self.wait_for_upsert(async_result)
+            except Exception as e:
+                failed += size
+                logger.error("Error upserting batch %d: %s", batch_number, e)
+        self.generation += 1
+        self._stats_cache = (0.0, None)
+        
+        return sum(batch_sizes) - failed, failed
+    
+    def query_index(self, embedding: np.ndarray, top_k: int = 5, filter_dict: Optional[Dict] = None) -> List[Dict]:
+        """Query the index with an embedding and return matching documents."""
+        # Execute search
+        values, _ = self.to_index_values(embedding[np.newaxis, :])
+        search_params = {
+            "vector": values[0].tolist(),
+            "top_k": top_k,
+            "include_metadata": True
+        }
+        
+        # Apply filter
+        if filter_dict:
+            search_params["filter"] = filter_dict
+        
+        results = self.index.query(**search_params)
+        
+        # Process results
+        documents = []
+        for match in results["matches"]:
+            doc = {
+                "id": match["id"],
+                "score": match["score"],
+                "text": match["metadata"]["text"],
+                "metadata": match["metadata"]
+            }
+            documents.append(doc)
+        
+        return documents
+    
     def search(self, query: str, top_k: int = 5, filter_dict: Optional[Dict] = None) -> List[Dict]:
         """Search for documents similar to query."""
         if not self.index:
-            print("Index not connected.")
+            logger.error("Index not connected.")
             return []
         
         try:
             # Create query embedding
             query_embedding = self.create_embeddings([query])
-            if not query_embedding:
+            if not len(query_embedding):
                 return []
             
-            # Execute search
-            search_params = {
-                "vector": query_embedding[0],
-                "top_k": top_k,
-                "include_metadata": True
-            }
-            
-            # Apply filter
-            if filter_dict:
-                search_params["filter"] = filter_dict
+            return self.query_index(query_embedding[0], top_k, filter_dict)
             
-            results = self.index.query(**search_params)
+        except Exception as e:
+            logger.error("Error during search: %s", e)
+            return []
+    
+    async def asearch(self, query: str, top_k: int = 5, filter_dict: Optional[Dict] = None) -> List[Dict]:
+        """Search for documents similar to query without blocking the event loop.
+        
+        Encoding and the Pinecone request both run in worker threads.
+        """
+        if not self.index:
+            logger.error("Index not connected.")
+            return []
+        
+        try:
+            loop = asyncio.get_running_loop()
             
-            # Process results
-            documents = []
-            for match in results["matches"]:
-                doc = {
-                    "id": match["id"],
-                    "score": match["score"],
-                    "text": match["metadata"]["text"],
-                    "metadata": match["metadata"]
-                }
-                documents.append(doc)
+            # Create query embedding
+            query_embedding = await loop.run_in_executor(None, self.create_embeddings, [query])
+            if not len(query_embedding):
+                return []
             
-            return documents
+            return await loop.run_in_executor(
+                None, self.query_index, query_embedding[0], top_k, filter_dict
+            )
             
         except Exception as e:
-            print(f"Error during search: {e}")
+            logger.error("Error during search: %s", e)
             return []
     
+    def search_batch(self, queries: List[str], top_k: int = 5,
+                     filter_dict: Optional[Dict] = None) -> List[List[Dict]]:
+        """Search for several queries at once.
+        
+        All queries are encoded in one batch and the index is queried concurrently.
+        Results are returned in the same order as ``queries``.
+        """
+        if not self.index:
+            logger.error("Index not connected.")
+            return [[] for _ in queries]
+        
+        try:
+            # Create all query embeddings at once
+            query_embeddings = self.create_embeddings(queries)
+            if not len(query_embeddings):
+                return [[] for _ in queries]
+            
+            with ThreadPoolExecutor(max_workers=min(16, len(queries))) as executor:
+                return list(executor.map(
+                    lambda embedding: self.query_index(embedding, top_k, filter_dict),
+                    query_embeddings
+                ))
+            
+        except Exception as e:
+            logger.error("Error during batch search: %s", e)
+            return [[] for _ in queries]
+    
     def search_by_bloom_level(self, query: str, bloom_level: str, top_k: int = 5) -> List[Dict]:
         """Search filtered by specific Bloom's Taxonomy level."""
         filter_dict = {
@@ -135,15 +376,20 @@ class VectorStore:
         return self.search(query, top_k, filter_dict)
     
     def get_index_stats(self) -> Dict:
-        """Get index statistics."""
+        """Get index statistics, reusing results younger than ``stats_ttl`` seconds."""
         if not self.index:
             return {}
         
+        timestamp, stats = self._stats_cache
+        if stats is not None and time.monotonic() - timestamp < self.stats_ttl:
+            return stats
+        
         try:
             stats = self.index.describe_index_stats()
+            self._stats_cache = (time.monotonic(), stats)
             return stats
         except Exception as e:
-            print(f"Error retrieving index stats: {e}")
+            logger.error("Error retrieving index stats: %s", e)
             return {}
     
     def delete_all_vectors(self) -> bool:
@@ -153,14 +399,18 @@ class VectorStore:
         
         try:
             self.index.delete(delete_all=True)
-            print("All vectors deleted successfully.")
+            self.generation += 1
+            self._stats_cache = (0.0, None)
+            logger.info("All vectors deleted successfully.")
             return True
         except Exception as e:
-            print(f"Error deleting vectors: {e}")
+            logger.error("Error deleting vectors: %s", e)
             return False
 
 def main():
     """Main function for testing"""
+    logging.basicConfig(level=os.getenv("QRAG_LOG_LEVEL", "INFO").upper(), format="%(message)s")
+    
     # Get API key from environment variables
     api_key = os.getenv("PINECONE_API_KEY")
     environment = os.getenv("PINECONE_ENVIRONMENT", "gcp-starter")